@@ -1,24 +1,101 @@
+import functools
 import logging
+import re
 import sqlite3
 import threading
+import time
 import uuid
 import queue
 
 LOGGER = logging.getLogger("SqliteWorker")
 
+_EXECUTE = 0
+_EXECUTEMANY = 1
+_STREAM = 2
+_FETCH = 3
+_SCRIPT = 4
+_PAUSE = 5
+_CLOSE = 6
+_STREAM_NEXT = 7
+_STREAM_CLOSE = 8
+
+_NO_VALUES = ()
+
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_RETURNING_RE = re.compile(r"\bRETURNING\b", re.IGNORECASE)
+_LITERAL_RE = re.compile(
+    r"""'[^']*'|"[^"]*"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?\*/""", re.DOTALL)
+_DML_RE = re.compile(
+    r"\b(?:INSERT|UPDATE|DELETE)\b|\bREPLACE\s+INTO\b", re.IGNORECASE)
+_ROW_KEYWORDS = ("select", "pragma", "values")
+
+
+def _strip_literals(query):
+    return _LITERAL_RE.sub(" ", query)
+
+
+def _has_returning(query):
+    # Cheap scan first; only strip literals and comments on a hit.
+    return (_RETURNING_RE.search(query) is not None
+            and _RETURNING_RE.search(_strip_literals(query)) is not None)
+
+
+def _returns_rows(query):
+    head = query.lstrip()[:6].lower()
+    if head.startswith("with"):
+        # A CTE can front a write; only reads and RETURNING produce rows.
+        code = _strip_literals(query)
+        return (_RETURNING_RE.search(code) is not None
+                or _DML_RE.search(code) is None)
+    return head.startswith(_ROW_KEYWORDS) or _has_returning(query)
+
+
+def _validate_identifier(name):
+    if not isinstance(name, str) or not _IDENTIFIER_RE.fullmatch(name):
+        raise ValueError(f"Invalid SQL identifier: {name!r}")
+
+
+@functools.lru_cache(maxsize=1024)
+def _build_insert(table_name, columns):
+    _validate_identifier(table_name)
+    for column in columns:
+        _validate_identifier(column)
+    return "INSERT INTO {} ({}) VALUES ({})".format(
+        table_name, ", ".join(columns), ", ".join("?" * len(columns)))
+
 
 class SqliteWorker:
     """Sqlite thread-safe object."""
 
-    def __init__(self, file_name, max_queue_size=100):
+    def __init__(self, file_name, max_queue_size=100, row_factory=None,
+                 cached_statements=256, execute_init=(), group_commit_delay=0,
+                 uri=False):
         self._file_name = file_name
+        self._uri = uri
+        self._group_commit_delay = group_commit_delay
+        self._execute_init = tuple(execute_init)
+        self._row_factory = row_factory
+        self._cached_statements = cached_statements
         self._sql_queue = queue.Queue(maxsize=max_queue_size)
         self._results = {}
         self._select_events = {}
+        self._streams = {}
+        self._replies = []
+        self._idle_condition = threading.Condition()
+        self._unfinished = 0
         self._close_event = threading.Event()
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._ready_event = threading.Event()
+        self._init_error = None
+        self._commit_error = None
         self._thread = threading.Thread(
             target=self._run, name=__name__, daemon=True)
         self._thread.start()
+        self._ready_event.wait()
+        if self._init_error is not None:
+            self._thread.join()
+            raise self._init_error
 
     def _run(self):
         try:
@@ -29,56 +106,327 @@ class SqliteWorker:
             raise
 
     def _process_queries(self):
-        with sqlite3.connect(self._file_name, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
+        try:
+            conn = self._connect()
+        except Exception as err:
+            self._init_error = err
+            return
+        finally:
+            self._ready_event.set()
+
+        with conn:
             cursor = conn.cursor()
             while not self._close_event.is_set() or not self._sql_queue.empty():
-                try:
-                    token, query, values = self._sql_queue.get(timeout=1)
-                except queue.Empty:
-                    continue
+                self._process_batch(conn, cursor, self._sql_queue.get())
+
+    def _connect(self):
+        conn = sqlite3.connect(self._file_name, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES,
+                               cached_statements=self._cached_statements, uri=self._uri)
+        conn.row_factory = self._row_factory
+        try:
+            for statement in self._execute_init:
+                conn.execute(statement)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
 
-                if query:
-                    self._execute_query(cursor, token, query, values)
+    def _process_batch(self, conn, cursor, item):
+        # Everything that is queued, or arrives within group_commit_delay
+        # seconds, shares one transaction; replies go out after the commit.
+        deadline = time.monotonic() + self._group_commit_delay
+        processed = 0
+        try:
+            while item is not None:
+                token, query, values, op = item
+                processed += 1
+                if op == _CLOSE or op == _PAUSE:
+                    break
+                self._execute_query(cursor, token, query, values, op)
+                item = self._next_in_batch(deadline)
+            self._commit(conn)
+        finally:
+            self._mark_done(processed)
+
+        if item is not None and item[3] == _PAUSE:
+            self._notify_query_done(item[0], None)
+            self._resume_event.wait()
 
-                if self._sql_queue.empty():
-                    conn.commit()
+    def _commit(self, conn):
+        replies, self._replies = self._replies, []
+        try:
+            conn.commit()
+        except Exception as err:
+            # e.g. a deferred foreign key; the whole batch is lost, so rows
+            # read inside it are not handed out either.
+            LOGGER.error("Commit error, batch rolled back: %s", err)
+            conn.rollback()
+            with self._idle_condition:
+                self._commit_error = err
+            replies = [(token, err) for token, _ in replies]
+        for token, result in replies:
+            self._notify_query_done(token, result)
 
-    def _execute_query(self, cursor, token, query, values):
+    def _next_in_batch(self, deadline):
+        remaining = deadline - time.monotonic()
         try:
+            if remaining > 0:
+                return self._sql_queue.get(timeout=remaining)
+            return self._sql_queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _execute_query(self, cursor, token, query, values, op):
+        try:
+            if op == _EXECUTEMANY:
+                self._executemany_atomic(cursor, query, values)
+                return
+            if op == _SCRIPT:
+                cursor.executescript(query)
+                self._replies.append((token, None))
+                return
+            if op == _STREAM:
+                self._open_stream(cursor, token, query, values)
+                return
+            if op == _STREAM_NEXT:
+                self._replies.append((token, self._fetch_stream(values)))
+                return
+            if op == _STREAM_CLOSE:
+                self._close_stream(values)
+                return
+
             cursor.execute(query, values)
-            if query.lower().startswith("select"):
-                self._results[token] = cursor.fetchall()
-                self._notify_query_done(token)
-        except sqlite3.Error as err:
-            LOGGER.error("Query error: %s: %s: %s", query, values, err)
-            self._handle_query_error(token, err)
+            if op == _FETCH:
+                self._replies.append((token, cursor.fetchall()))
+        except Exception as err:
+            if op == _EXECUTEMANY:
+                # The parameters may be huge or a spent generator.
+                LOGGER.error("Query error: %s: %s", query, err)
+            else:
+                LOGGER.error("Query error: %s: %s: %s", query, values, err)
+            self._replies.append((token, err))
+
+    @staticmethod
+    def _executemany_atomic(cursor, query, values):
+        # A failing row must not leave the rows before it in the batch.
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN")
+        cursor.execute("SAVEPOINT executemany")
+        try:
+            cursor.executemany(query, values)
+        except Exception:
+            cursor.execute("ROLLBACK TO executemany")
+            raise
+        finally:
+            cursor.execute("RELEASE executemany")
+
+    def _open_stream(self, cursor, token, query, values):
+        # Each stream gets its own cursor, kept open between fetches.
+        params, batch_size = values
+        stream_cursor = cursor.connection.cursor()
+        stream_cursor.execute(query, params)
+        self._streams[token] = (stream_cursor, batch_size)
+        self._replies.append((token, self._fetch_stream(token)))
+
+    def _fetch_stream(self, stream):
+        stream_cursor, batch_size = self._streams[stream]
+        try:
+            rows = stream_cursor.fetchmany(batch_size)
+        except Exception:
+            self._close_stream(stream)
             raise
+        if len(rows) < batch_size:
+            self._close_stream(stream)
+        return rows
 
-    def _notify_query_done(self, token):
-        self._select_events.setdefault(token, threading.Event()).set()
+    def _close_stream(self, stream):
+        stream_cursor, _ = self._streams.pop(stream, (None, None))
+        if stream_cursor is not None:
+            stream_cursor.close()
 
-    def _handle_query_error(self, token, err):
-        self._results[token] = err
-        self._notify_query_done(token)
+    def _notify_query_done(self, token, result):
+        # Popping the event claims the token; a caller that timed out has
+        # already removed it, so nothing is left behind in _results.
+        event = self._select_events.pop(token, None)
+        if event is not None:
+            self._results[token] = result
+            event.set()
 
     def close(self):
         self._close_event.set()
-        self._sql_queue.put(("", "", ""), timeout=5)
+        self._resume_event.set()
+        self._put(("", "", _NO_VALUES, _CLOSE))
         self._thread.join()
 
-    def execute(self, query, values=None):
+    def execute(self, query, values=None, timeout=None):
+        """Queue a statement, and return its rows if it produces any.
+
+        `timeout` limits the wait for rows in seconds; TimeoutError is
+        raised when it runs out. Only the result is abandoned: the statement
+        still runs and commits, so retrying a timed out write such as
+        INSERT ... RETURNING can apply it twice.
+        """
+        if _returns_rows(query):
+            return self._enqueue_and_wait(
+                query, values or _NO_VALUES, _FETCH, timeout)
+        self._enqueue(query, values or _NO_VALUES, _EXECUTE)
+
+    def try_execute(self, query, values=None):
+        """Queue a statement without blocking on a full queue.
+
+        Returns False if the queue is full so the caller can back off or
+        batch the work for `executemany`. Statements that return rows
+        (SELECT, PRAGMA, VALUES, WITH queries that read, or anything with a
+        RETURNING clause) are rejected because their results have to be
+        waited for.
+        """
+        if _returns_rows(query):
+            raise ValueError(
+                "try_execute does not accept statements that return rows")
+        try:
+            self._enqueue(query, values or _NO_VALUES, _EXECUTE, block=False)
+        except queue.Full:
+            return False
+        return True
+
+    def executemany(self, query, values):
+        """Run `query` once for every parameter sequence in `values`.
+
+        `values` may be any iterable, including a generator; it is consumed
+        on the worker thread, so rows are never collected into a list. The
+        batch is atomic: if a row or the generator itself raises, none of
+        its rows are kept and the error is logged.
+        """
+        self._enqueue(query, values, _EXECUTEMANY)
+
+    def executescript(self, script, timeout=None):
+        """Run several `;`-separated statements and wait for them to finish.
+
+        Returns None on success, or the exception the script raised. As
+        with `execute`, a `timeout` abandons the wait, not the script.
+        """
+        return self._enqueue_and_wait(script, None, _SCRIPT, timeout)
+
+    def insert_many(self, table_name, rows):
+        """Insert a list of dicts, one prepared statement per column set."""
+        batches = {}
+        for row in rows:
+            batches.setdefault(tuple(row), []).append(tuple(row.values()))
+        for columns, values in batches.items():
+            self.executemany(_build_insert(table_name, columns), values)
+
+    def execute_stream(self, query, values=None, batch_size=1000):
+        """Run a SELECT and return an iterator over its rows.
+
+        The query runs when iteration starts. The worker keeps its cursor
+        open and fetches the next `batch_size` rows only once the previous
+        batch has been consumed, so at most one batch is held in memory.
+        Leaving the loop early closes the cursor.
+        """
+        return self._iter_stream(query, values or _NO_VALUES, batch_size)
+
+    def _iter_stream(self, query, values, batch_size):
+        stream = str(uuid.uuid4())
+        rows = self._enqueue_and_wait(
+            query, (values, batch_size), _STREAM, token=stream)
+        try:
+            while True:
+                if isinstance(rows, Exception):
+                    raise rows
+                yield from rows
+                if len(rows) < batch_size:
+                    return
+                rows = self._enqueue_and_wait("", stream, _STREAM_NEXT)
+        finally:
+            # The worker closes exhausted and failed streams itself.
+            if stream in self._streams:
+                try:
+                    self._enqueue("", stream, _STREAM_CLOSE)
+                except RuntimeError:
+                    pass
+
+    def _enqueue(self, query, values, op, token=None, block=True):
         if self._close_event.is_set():
             raise RuntimeError("Worker is closed")
+        if not self._thread.is_alive():
+            raise RuntimeError("Worker thread has died")
+
+        token = token or str(uuid.uuid4())
+        self._put((token, query, values, op), block)
+        return token
+
+    def _put(self, item, block=True):
+        # Count the item before it becomes visible to the worker, so the
+        # worker can never mark it done first.
+        with self._idle_condition:
+            self._unfinished += 1
+        try:
+            self._sql_queue.put(item, block, timeout=5)
+        except queue.Full:
+            self._mark_done(1)
+            raise
+
+    def _mark_done(self, count):
+        with self._idle_condition:
+            self._unfinished -= count
+            if not self._unfinished:
+                self._idle_condition.notify_all()
 
-        token = str(uuid.uuid4())
-        self._sql_queue.put((token, query, values or []), timeout=5)
-        if query.lower().startswith("select"):
-            return self._fetch_query_results(token)
+    def _enqueue_and_wait(self, query, values, op, timeout=None, token=None):
+        token = token or str(uuid.uuid4())
+        event = threading.Event()
+        self._select_events[token] = event
+        try:
+            self._enqueue(query, values, op, token)
+        except Exception:
+            del self._select_events[token]
+            raise
+        return self._fetch_query_results(token, event, timeout)
 
-    def _fetch_query_results(self, token):
-        event = self._select_events.setdefault(token, threading.Event())
+    def _fetch_query_results(self, token, event, timeout):
+        if (not event.wait(timeout)
+                and self._select_events.pop(token, None) is not None):
+            raise TimeoutError("Timed out waiting for query results")
+        # Either the wait succeeded or the worker claimed the token first,
+        # in which case the result is about to be published.
         event.wait()
-        return self._results.pop(token, None)
+        return self._results.pop(token)
+
+    def pause(self):
+        """Stop the worker from taking statements off the queue.
+
+        Returns once everything queued before the call has been committed;
+        statements queued afterwards wait until `resume` is called.
+        Pausing an already paused worker does nothing.
+        """
+        if not self._resume_event.is_set():
+            return
+        self._resume_event.clear()
+        try:
+            self._enqueue_and_wait("", _NO_VALUES, _PAUSE)
+        except Exception:
+            # Not paused after all, e.g. because the worker is closed.
+            self._resume_event.set()
+            raise
+
+    def resume(self):
+        """Let a paused worker take statements off the queue again."""
+        self._resume_event.set()
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued statement has run and been committed.
+
+        Returns False if `timeout` seconds pass first. If a commit failed
+        since the previous call, its batch was rolled back and the commit
+        error is raised instead.
+        """
+        with self._idle_condition:
+            idle = self._idle_condition.wait_for(
+                lambda: not self._unfinished, timeout)
+            error, self._commit_error = self._commit_error, None
+        if error is not None:
+            raise error
+        return idle
 
     @property
     def queue_size(self):
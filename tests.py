@@ -1,4 +1,7 @@
+import os
+import tempfile
 import threading
+import time
 import unittest
 from sqlite_worker import SqliteWorker
 import sqlite3
@@ -9,15 +12,22 @@ import sqlite3
 
 class TestSqliteWorker(unittest.TestCase):
 
-    def setUp(self):
-        # Set up an in-memory SQLite database for testing
-        self.worker = SqliteWorker(":memory:")
-        self.worker.execute(
-            "CREATE TABLE test (id INTEGER PRIMARY KEY, name TEXT)")
+    @classmethod
+    def setUpClass(cls):
+        # Share one in-memory SQLite worker across the tests in this class
+        cls.worker = SqliteWorker(":memory:")
 
-    def tearDown(self):
-        # Close the worker after each test
-        self.worker.close()
+    @classmethod
+    def tearDownClass(cls):
+        cls.worker.close()
+
+    def setUp(self):
+        # Start every test from a fresh table
+        self.worker.executescript("""
+            DROP TABLE IF EXISTS other;
+            DROP TABLE IF EXISTS test;
+            CREATE TABLE test (id INTEGER PRIMARY KEY, name TEXT);
+        """)
 
     def test_execute_insert_query(self):
         # Test insert operation
@@ -34,6 +44,233 @@ class TestSqliteWorker(unittest.TestCase):
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0][1], "Bob")
 
+    def test_select_error(self):
+        # Test that a failing select returns its error and the worker lives on
+        with self.assertLogs("SqliteWorker", level="ERROR"):
+            err = self.worker.execute("SELECT * FROM missing", timeout=5)
+        self.assertIsInstance(err, sqlite3.OperationalError)
+        self.assertEqual(self.worker.execute("SELECT 1", timeout=5), [(1,)])
+
+    def test_insert_error(self):
+        # Test that a failing write is logged without affecting later ones
+        with self.assertLogs("SqliteWorker", level="ERROR"):
+            self.worker.execute(
+                "INSERT INTO missing (name) VALUES (?)", ("x",))
+            self.worker.execute("INSERT INTO test (name) VALUES (?)", ("Kim",))
+            result = self.worker.execute("SELECT name FROM test", timeout=5)
+        self.assertEqual(result, [("Kim",)])
+
+    def test_execute_stream_error(self):
+        # Test that a failing stream raises from its iterator
+        with self.assertLogs("SqliteWorker", level="ERROR"):
+            with self.assertRaises(sqlite3.OperationalError):
+                list(self.worker.execute_stream("SELECT * FROM missing"))
+        self.assertEqual(self.worker._streams, {})
+
+    def test_executemany_error(self):
+        # Test that a failing row rolls back its whole executemany batch
+        with self.assertLogs("SqliteWorker", level="ERROR"):
+            self.worker.executemany(
+                "INSERT INTO test (id, name) VALUES (?, ?)",
+                [(1, "a"), (2, "b"), (1, "c"), (3, "d")])
+            self.worker.execute("INSERT INTO test (name) VALUES (?)", ("Kim",))
+            result = self.worker.execute(
+                "SELECT id, name FROM test", timeout=5)
+        self.assertEqual(result, [(1, "Kim")])
+
+    def test_insert_many_error(self):
+        # Test that a failing dict row rolls back its insert_many batch
+        with self.assertLogs("SqliteWorker", level="ERROR"):
+            self.worker.insert_many("test", [
+                {"id": 1, "name": "a"}, {"id": 1, "name": "b"}])
+            result = self.worker.execute(
+                "SELECT id, name FROM test", timeout=5)
+        self.assertEqual(result, [])
+
+    def test_executemany_non_sqlite_error(self):
+        # Test that errors outside sqlite3.Error do not stop the worker
+        with self.assertLogs("SqliteWorker", level="ERROR"):
+            self.worker.executemany("INSERT INTO test (name) VALUES (?)", None)
+            self.worker.execute("INSERT INTO test (name) VALUES (?)", ("Lee",))
+            result = self.worker.execute("SELECT name FROM test", timeout=5)
+        self.assertEqual(result, [("Lee",)])
+
+    def test_execute_stream_non_sqlite_error(self):
+        # Test that a non-sqlite stream error is raised from the iterator
+        with self.assertLogs("SqliteWorker", level="ERROR"):
+            with self.assertRaises(TypeError):
+                list(self.worker.execute_stream("SELECT 1", batch_size="x"))
+        self.assertEqual(self.worker.execute("SELECT 1", timeout=5), [(1,)])
+
+    def test_select_with_leading_whitespace(self):
+        # Test that selects are detected regardless of indentation
+        self.worker.execute("INSERT INTO test (name) VALUES (?)", ("Dave",))
+        result = self.worker.execute("""
+            SELECT name FROM test""")
+        self.assertEqual(result, [("Dave",)])
+
+    def test_execute_returning(self):
+        # Test that RETURNING rows come back in a single round-trip
+        result = self.worker.execute(
+            "INSERT INTO test (name) VALUES (?) RETURNING id, name", ("Gina",))
+        self.assertEqual(result, [(1, "Gina")])
+        result = self.worker.execute(
+            "UPDATE test SET name = ? WHERE id = ? returning name",
+            ("Hank", 1))
+        self.assertEqual(result, [("Hank",)])
+        result = self.worker.execute(
+            "DELETE FROM test WHERE id = ? RETURNING id", (2,))
+        self.assertEqual(result, [])
+
+    def test_returning_in_literals(self):
+        # Test that RETURNING inside strings or comments is not a clause
+        self.assertIsNone(self.worker.execute(
+            "INSERT INTO test (name) VALUES ('returning')"))
+        self.assertTrue(self.worker.try_execute(
+            "INSERT INTO test (name) VALUES (?) -- returning", ("x",)))
+        self.assertTrue(self.worker.try_execute(
+            'INSERT INTO test ("name") VALUES (/* RETURNING */ ?)', ("y",)))
+        result = self.worker.execute("SELECT name FROM test ORDER BY id")
+        self.assertEqual(result, [("returning",), ("x",), ("y",)])
+
+    def test_try_execute(self):
+        # Test non-blocking execution of write statements
+        self.assertTrue(self.worker.try_execute(
+            "INSERT INTO test (name) VALUES (?)", ("Frank",)))
+        result = self.worker.execute("SELECT name FROM test")
+        self.assertEqual(result, [("Frank",)])
+        with self.assertRaises(ValueError):
+            self.worker.try_execute("SELECT * FROM test")
+
+    def test_execute_with_and_values(self):
+        # Test that CTE and VALUES queries return their rows
+        result = self.worker.execute(
+            "WITH names (name) AS (VALUES ('Jack')) SELECT name FROM names")
+        self.assertEqual(result, [("Jack",)])
+        self.assertEqual(self.worker.execute("VALUES (1), (2)"), [(1,), (2,)])
+
+    def test_with_writes(self):
+        # Test that CTE-fronted writes are queued like other writes
+        cte = "WITH src (name) AS (VALUES ('Mia')) "
+        self.assertIsNone(self.worker.execute(
+            cte + "INSERT INTO test (name) SELECT name FROM src"))
+        self.assertTrue(self.worker.try_execute(
+            cte + "UPDATE test SET name = (SELECT name FROM src) || '!'"))
+        self.assertEqual(self.worker.execute(
+            cte + "DELETE FROM test WHERE name = 'x' RETURNING id"), [])
+        self.assertEqual(self.worker.execute(
+            "WITH n (v) AS (SELECT replace('a-b', '-', '')) SELECT v FROM n"),
+            [("ab",)])
+        self.assertEqual(
+            self.worker.execute("SELECT name FROM test"), [("Mia!",)])
+
+    def test_executemany(self):
+        # Test batched insert through a single queue item
+        self.worker.executemany(
+            "INSERT INTO test (name) VALUES (?)", [("Alice",), ("Bob",)])
+        result = self.worker.execute("SELECT name FROM test ORDER BY id")
+        self.assertEqual(result, [("Alice",), ("Bob",)])
+
+    def test_executescript(self):
+        # Test multi-statement scripts, including a ';' inside a literal
+        result = self.worker.executescript("""
+            CREATE TABLE other (value TEXT);
+            INSERT INTO other (value) VALUES ('a;b');
+            INSERT INTO test (name) VALUES ('Eve');
+        """)
+        self.assertIsNone(result)
+        self.assertEqual(
+            self.worker.execute("SELECT value FROM other"), [("a;b",)])
+        self.assertEqual(
+            self.worker.execute("SELECT name FROM test"), [("Eve",)])
+
+    def test_executemany_generator(self):
+        # Test that executemany consumes a lazy iterable of parameters
+        self.worker.executemany(
+            "INSERT INTO test (name) VALUES (?)",
+            ((f"gen{i}",) for i in range(3)))
+        result = self.worker.execute("SELECT name FROM test ORDER BY id")
+        self.assertEqual(result, [("gen0",), ("gen1",), ("gen2",)])
+
+    def test_executescript_empty(self):
+        # Test that an empty script is a no-op rather than a queue marker
+        self.assertIsNone(self.worker.executescript("", timeout=5))
+
+    def test_executemany_generator_error(self):
+        # Test that a failing generator is rolled back and the worker lives on
+        def rows():
+            yield ("gen0",)
+            raise ValueError("bad row")
+
+        with self.assertLogs("SqliteWorker", level="ERROR") as logs:
+            self.worker.executemany(
+                "INSERT INTO test (name) VALUES (?)", rows())
+            result = self.worker.execute("SELECT name FROM test", timeout=5)
+        self.assertEqual(result, [])
+        # Bulk parameters are left out of the log line
+        self.assertNotIn("generator", logs.output[0])
+
+    def test_insert_many(self):
+        # Test bulk insert of dict rows, including mixed column sets
+        self.worker.insert_many("test", [
+            {"name": "Alice"},
+            {"id": 10, "name": "Bob"},
+            {"name": "Carol"},
+        ])
+        result = self.worker.execute("SELECT id, name FROM test ORDER BY id")
+        self.assertEqual(result, [(1, "Alice"), (2, "Carol"), (10, "Bob")])
+
+    def test_insert_many_invalid_identifiers(self):
+        # Test that table and column names are validated before queueing
+        cases = {
+            "table": ("test; DROP TABLE test", [{"name": "Alice"}]),
+            "column": ("test", [{"name) VALUES ('x'); --": "Alice"}]),
+            "empty": ("", [{"name": "Alice"}]),
+        }
+        for case, (table_name, rows) in cases.items():
+            with self.subTest(case=case):
+                with self.assertRaises(ValueError):
+                    self.worker.insert_many(table_name, rows)
+
+    def test_execute_stream(self):
+        # Test that streamed rows match a regular select across batches
+        self.worker.executemany(
+            "INSERT INTO test (name) VALUES (?)",
+            [(f"row{i}",) for i in range(25)])
+        rows = self.worker.execute_stream(
+            "SELECT * FROM test ORDER BY id", batch_size=10)
+        self.assertEqual(
+            list(rows), self.worker.execute("SELECT * FROM test ORDER BY id"))
+
+    def test_execute_stream_empty_query(self):
+        # Test that an empty query ends the stream instead of hanging
+        self.assertEqual(list(self.worker.execute_stream("")), [])
+        self.assertEqual(self.worker._streams, {})
+
+    def test_execute_stream_abandoned(self):
+        # Test that batches are fetched on demand and an early exit closes
+        self.worker.executemany(
+            "INSERT INTO test (name) VALUES (?)",
+            [(f"row{i}",) for i in range(25)])
+        rows = self.worker.execute_stream(
+            "SELECT name FROM test ORDER BY id", batch_size=10)
+        self.assertEqual(next(rows), ("row0",))
+        self.assertEqual(len(self.worker._streams), 1)
+        rows.close()
+        self.assertTrue(self.worker.wait_idle(timeout=5))
+        self.assertEqual(self.worker._streams, {})
+
+    def test_bulk_insert_throughput(self):
+        # Test that a large executemany batch stays well within budget
+        start = time.perf_counter()
+        self.worker.executemany(
+            "INSERT INTO test (name) VALUES (?)",
+            [("Bulk",) for _ in range(10000)])
+        self.assertTrue(self.worker.wait_idle(timeout=5))
+        self.assertLess(time.perf_counter() - start, 2.0)
+        result = self.worker.execute("SELECT COUNT(*) FROM test")
+        self.assertEqual(result[0][0], 10000)
+
     def test_thread_safety(self):
         # Test thread safety by executing concurrent queries
         def insert_data():
@@ -51,6 +288,66 @@ class TestSqliteWorker(unittest.TestCase):
             "SELECT COUNT(*) FROM test WHERE name = ?", ("ThreadTest",))
         self.assertEqual(result[0][0], 1000)
 
+    def test_wait_idle(self):
+        # Test waiting for queued writes without issuing a select
+        for _ in range(50):
+            self.worker.execute(
+                "INSERT INTO test (name) VALUES (?)", ("Idle",))
+        self.assertTrue(self.worker.wait_idle(timeout=5))
+        self.assertEqual(self.worker.queue_size, 0)
+
+
+class TestSqliteWorkerLifecycle(unittest.TestCase):
+
+    def setUp(self):
+        # Tests here configure or close the worker, so each gets its own
+        self.worker = SqliteWorker(":memory:")
+
+    def tearDown(self):
+        self.worker.close()
+
+    def test_queue_size(self):
+        # Test queue size deterministically while the worker is paused
+        self.worker.pause()
+        self.worker.execute("CREATE TABLE test (name TEXT)")
+        self.assertEqual(self.worker.queue_size, 1)
+        self.worker.resume()
+        self.assertTrue(self.worker.wait_idle(timeout=5))
+        self.assertEqual(self.worker.queue_size, 0)
+
+    def test_pause_twice(self):
+        # Test that pausing a paused worker returns instead of deadlocking
+        self.worker.pause()
+        self.worker.pause()
+        self.worker.execute("CREATE TABLE test (name TEXT)")
+        self.worker.resume()
+        self.assertTrue(self.worker.wait_idle(timeout=5))
+
+    def test_execute_timeout(self):
+        # Test that an abandoned select times out without leaking results
+        self.worker.pause()
+        with self.assertRaises(TimeoutError):
+            self.worker.execute("SELECT 1", timeout=0.01)
+        self.worker.resume()
+        self.assertTrue(self.worker.wait_idle(timeout=5))
+        self.assertEqual(self.worker.execute("SELECT 2", timeout=5), [(2,)])
+        self.assertEqual(self.worker._select_events, {})
+        self.assertEqual(self.worker._results, {})
+
+    def test_close_paused_worker(self):
+        # Test that closing a paused worker still drains the queue
+        self.worker.pause()
+        self.worker.execute("CREATE TABLE test (name TEXT)")
+        self.worker.close()
+        self.assertEqual(self.worker.queue_size, 0)
+
+    def test_pause_closed_worker(self):
+        # Test that a failed pause does not leave the worker marked paused
+        self.worker.close()
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                self.worker.pause()
+
     def test_close_worker(self):
         # Test closing the worker
         self.worker.close()
@@ -58,5 +355,149 @@ class TestSqliteWorker(unittest.TestCase):
             self.worker.execute("SELECT * FROM test")
 
 
+class TestSqliteWorkerOptions(unittest.TestCase):
+
+    def test_try_execute_full_queue(self):
+        # Test that try_execute reports a full queue instead of blocking
+        worker = SqliteWorker(":memory:", max_queue_size=1)
+        try:
+            worker.pause()
+            self.assertTrue(worker.try_execute("CREATE TABLE test (x)"))
+            self.assertFalse(worker.try_execute("CREATE TABLE other (x)"))
+            worker.resume()
+            self.assertTrue(worker.wait_idle(timeout=5))
+            self.assertEqual(worker.execute(
+                "SELECT name FROM sqlite_master"), [("test",)])
+        finally:
+            worker.close()
+
+    def test_row_factory(self):
+        # Test that rows are built by the configured row factory
+        worker = SqliteWorker(":memory:", row_factory=sqlite3.Row)
+        try:
+            result = worker.execute("SELECT 1 AS id, 'Ivy' AS name")
+            self.assertEqual(result[0]["name"], "Ivy")
+            self.assertEqual(tuple(result[0]), (1, "Ivy"))
+        finally:
+            worker.close()
+
+    def test_execute_init(self):
+        # Test that init statements run on the worker's own connection
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            worker = SqliteWorker(
+                os.path.join(tmp_dir, "test.db"),
+                execute_init=("PRAGMA journal_mode=WAL;",
+                              "PRAGMA synchronous=NORMAL;"))
+            try:
+                self.assertEqual(
+                    worker.execute("PRAGMA journal_mode;"), [("wal",)])
+                self.assertEqual(
+                    worker.execute("PRAGMA synchronous;"), [(1,)])
+            finally:
+                worker.close()
+
+    def test_uri(self):
+        # Test that URI file names such as shared in-memory databases work
+        db_uri = "file:sqliteworker_test?mode=memory&cache=shared"
+        worker = SqliteWorker(db_uri, uri=True)
+        try:
+            worker.execute("CREATE TABLE test (name TEXT)")
+            worker.execute("INSERT INTO test (name) VALUES (?)", ("Uri",))
+            self.assertTrue(worker.wait_idle(timeout=5))
+            conn = sqlite3.connect(db_uri, uri=True)
+            try:
+                rows = conn.execute("SELECT name FROM test").fetchall()
+                self.assertEqual(rows, [("Uri",)])
+            finally:
+                conn.close()
+        finally:
+            worker.close()
+
+    def test_group_commit(self):
+        # Test that writes stay uncommitted until the commit window ends
+        delay = 0.1
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "test.db")
+            worker = SqliteWorker(path, group_commit_delay=delay)
+            conn = sqlite3.connect(path)
+            try:
+                worker.execute("CREATE TABLE test (name TEXT)")
+                self.assertTrue(worker.wait_idle(timeout=5))
+
+                start = time.monotonic()
+                for _ in range(10):
+                    worker.execute(
+                        "INSERT INTO test (name) VALUES (?)", ("Group",))
+                # Nothing is committed while the window is open...
+                count = conn.execute("SELECT COUNT(*) FROM test")
+                self.assertEqual(count.fetchone()[0], 0)
+
+                # ...and rows read inside it are only handed out after it
+                self.assertEqual(
+                    worker.execute("SELECT COUNT(*) FROM test"), [(10,)])
+                self.assertGreaterEqual(time.monotonic() - start, delay)
+                count = conn.execute("SELECT COUNT(*) FROM test")
+                self.assertEqual(count.fetchone()[0], 10)
+                self.assertTrue(worker.wait_idle(timeout=5))
+            finally:
+                conn.close()
+                worker.close()
+
+    def test_commit_error(self):
+        # Test that a failed commit is rolled back, reported and survived
+        worker = SqliteWorker(
+            ":memory:", execute_init=("PRAGMA foreign_keys=ON;",))
+        try:
+            worker.executescript("""
+                CREATE TABLE parent (id INTEGER PRIMARY KEY);
+                CREATE TABLE child (parent_id INTEGER REFERENCES parent (id)
+                                    DEFERRABLE INITIALLY DEFERRED);
+            """)
+            with self.assertLogs("SqliteWorker", level="ERROR"):
+                worker.execute("INSERT INTO child (parent_id) VALUES (1)")
+                with self.assertRaises(sqlite3.IntegrityError):
+                    worker.wait_idle(timeout=5)
+            self.assertTrue(worker.wait_idle(timeout=5))
+            self.assertEqual(
+                worker.execute("SELECT COUNT(*) FROM child", timeout=5),
+                [(0,)])
+        finally:
+            worker.close()
+
+    def test_commit_error_replies(self):
+        # Test that rows read inside a failed batch are replaced by its error
+        worker = SqliteWorker(
+            ":memory:", execute_init=("PRAGMA foreign_keys=ON;",))
+        try:
+            worker.executescript("""
+                CREATE TABLE parent (id INTEGER PRIMARY KEY);
+                CREATE TABLE child (parent_id INTEGER REFERENCES parent (id)
+                                    DEFERRABLE INITIALLY DEFERRED);
+            """)
+            worker.pause()
+            worker.execute("INSERT INTO child (parent_id) VALUES (1)")
+            results = []
+            reader = threading.Thread(target=lambda: results.append(
+                worker.execute("SELECT COUNT(*) FROM child", timeout=5)))
+            reader.start()
+            while worker.queue_size < 2:
+                time.sleep(0.001)
+            with self.assertLogs("SqliteWorker", level="ERROR"):
+                worker.resume()
+                reader.join()
+            self.assertIsInstance(results[0], sqlite3.IntegrityError)
+        finally:
+            worker.close()
+
+    def test_init_errors_raised(self):
+        # Test that connection and init failures surface from the constructor
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            missing_dir = os.path.join(tmp_dir, "missing", "test.db")
+            with self.assertRaises(sqlite3.OperationalError):
+                SqliteWorker(missing_dir)
+        with self.assertRaises(sqlite3.OperationalError):
+            SqliteWorker(":memory:", execute_init=("PRAGMA nonsense(",))
+
+
 if __name__ == '__main__':
     unittest.main()